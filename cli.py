@@ -1,21 +1,25 @@
 #!/usr/bin/env python3
 
 from __future__ import annotations
+import io
 import json
 import os
+import queue
 import re
+import select
 import sys
 import threading
 import time
 from itertools import cycle
 from pathlib import Path
-from typing import List
+from typing import Iterator, List
 
 import requests
+from requests.adapters import HTTPAdapter
 from prompt_toolkit import PromptSession, print_formatted_text
 from prompt_toolkit.completion import WordCompleter
-from prompt_toolkit.formatted_text import ANSI, FormattedText
-from prompt_toolkit.history import FileHistory
+from prompt_toolkit.formatted_text import ANSI, FormattedText, to_formatted_text
+from prompt_toolkit.history import FileHistory, ThreadedHistory
 from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit.styles import Style
 
@@ -23,10 +27,87 @@ from pygments import highlight
 from pygments.lexers import PythonLexer
 from pygments.formatters import Terminal256Formatter
 
+try:
+    # orjson decodes the small per-token SSE payloads 2-3x faster than stdlib
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 _PY_LEXER = PythonLexer(ensurenl=False, stripnl=False)
 _FMT = Terminal256Formatter(style="monokai")  # any 256-colour style works
 
+_TAG_RX = re.compile(rb"<(/?)(python|output)>", re.IGNORECASE)
+# Characters that can follow '<' in a real tag; a frozenset membership test is
+# far cheaper than hitting the regex engine for every stray '<' in the stream.
+_TAG_START_CHARS = frozenset(b"/ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
+# Compact the stream buffer once this much of it has been consumed.
+_COMPACT_AT = 4096
+
+# Pre-built style-class strings per segment kind — the streaming loop indexes
+# this instead of formatting "class:..." per emitted segment.
+_CLS = {
+    "python": "class:python",
+    "output": "class:output",
+    None: "class:reason",
+}
+
+# Decide color support once at startup; the streaming loop then calls a single
+# pre-bound renderer with no per-segment branching on tty/NO_COLOR.
+_IS_TTY = sys.stdout.isatty()
+_ENABLE_COLOR = _IS_TTY and not os.environ.get("NO_COLOR")
+# Tag detection only matters for styling python/output blocks; without color
+# (or with TOOLSEEK_NO_TAGS=1) skip the regex scanning entirely.
+_ENABLE_TAGS = _ENABLE_COLOR and not os.environ.get("TOOLSEEK_NO_TAGS")
+
+
+def _render_python_pygments(code: str) -> list:
+    return to_formatted_text(ANSI(highlight(code, _PY_LEXER, _FMT)))
+
+
+def _render_python_plain(code: str) -> list:
+    return [("class:python", code)]
+
+
+# "Lite" highlighter: a single compiled regex pass that colors comments,
+# strings, and keywords with inline ANSI. A full Pygments tokenize per block is
+# overkill when all we want is "code looks distinct from prose"; opt in with
+# TOOLSEEK_LITE_HIGHLIGHT=1.
+_PY_LITE = re.compile(
+    r"(#[^\n]*)"
+    r"|('[^'\n]*'|\"[^\"\n]*\")"
+    r"|\b(def|class|if|elif|else|for|while|return|import|from|as|with|try"
+    r"|except|finally|in|is|not|and|or|lambda|yield|pass|break|continue)\b"
+)
+# comment, string, keyword
+_LITE_COLORS = ("\x1b[38;5;245m", "\x1b[38;5;186m", "\x1b[38;5;81m")
+_LITE_RESET = "\x1b[39m"
+
+
+def _lite_colorize(m: re.Match) -> str:
+    return _LITE_COLORS[m.lastindex - 1] + m.group(0) + _LITE_RESET
+
+
+def _render_python_lite(code: str) -> list:
+    return to_formatted_text(ANSI(_PY_LITE.sub(_lite_colorize, code)))
+
+
+if not _ENABLE_COLOR:
+    render_python = _render_python_plain
+elif os.environ.get("TOOLSEEK_LITE_HIGHLIGHT"):
+    render_python = _render_python_lite
+else:
+    render_python = _render_python_pygments
+
 API_URL = os.getenv("LLM_API_URL", "http://localhost:8000/v1/chat/completions")
+
+# One keep-alive connection reused across turns — skips a TCP (+TLS) handshake
+# per prompt. trust_env=False also skips the proxy lookup; the server is
+# usually localhost.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+SESSION.trust_env = False
 HISTORY_FILE = Path.home() / ".toolseek_cli_history"
 SLASH_CMDS = ("clear", "exit", "quit", "help")
 
@@ -43,36 +124,135 @@ CLI_STYLE = Style.from_dict(
 )
 
 session = PromptSession(
-    history=FileHistory(str(HISTORY_FILE)),
+    # ThreadedHistory loads/appends the history file off the render thread, so
+    # the first prompt isn't gated on reading a potentially large file
+    history=ThreadedHistory(FileHistory(str(HISTORY_FILE))),
     completer=WordCompleter([f"/{c}" for c in SLASH_CMDS], ignore_case=True),
     style=CLI_STYLE,
 )
 
 ChatHist = List[dict]
 
+# Set by main() when stdout is piped: a block-buffered wrapper over the real
+# stdout that display() writes to directly. print_formatted_text can't be
+# used there — its output object was bound to the original stdout at import
+# and flushes unconditionally after every call.
+_PIPE_OUT: io.TextIOWrapper | None = None
+
 
 # ─────────────────────────── utilities ─────────────────────────── #
-def display(text: str | FormattedText, end: str = "", flush: bool = True) -> None:
+def display(text: str | FormattedText, end: str = "", flush: bool | None = None) -> None:
     """Safe wrapper around print_formatted_text inside patch_stdout()."""
+    # a tty flushes per call for live streaming; piped output coalesces in the
+    # block buffer and is flushed once per turn by the main loop
+    if flush is None:
+        flush = _IS_TTY
+    if _PIPE_OUT is not None:
+        # styling is disabled without a tty, so write the plain text straight
+        # into the block buffer instead of going through the renderer
+        if not isinstance(text, str):
+            text = "".join(frag[1] for frag in to_formatted_text(text))
+        _PIPE_OUT.write(text + end)
+        if flush:
+            _PIPE_OUT.flush()
+        return
     print_formatted_text(text, end=end, style=CLI_STYLE, flush=flush)
 
 
-def spinner(stop_evt: threading.Event) -> None:
+def spin_until_readable(resp: requests.Response, max_wait: float = 2.0) -> None:
     """
     Ultra-simple CLI spinner.
 
-    Runs in its own *non-async* thread and writes directly to stdout.
-    Nothing else to clean up: when `stop_evt.set()` is called the loop
-    breaks, blanks the line, flushes, and the thread dies.
+    Runs on the main thread: select() on the response socket with a short
+    timeout, drawing a frame on each timeout and returning as soon as body
+    bytes are readable. No second thread, no Event, no join.
     """
+    try:
+        fd = resp.raw.fileno()
+    except (OSError, ValueError):
+        return
     frames = cycle("⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏")
-    while not stop_evt.is_set():
+    drew = False
+    # Body bytes delivered in the same recv as the headers sit in
+    # http.client's buffer and never show up on the socket fd, so a quick
+    # response can leave the socket silent forever — give up after max_wait
+    # and let the read path find whatever is buffered.
+    deadline = time.monotonic() + max_wait
+    while not select.select([fd], [], [], 0.08)[0]:
+        if time.monotonic() >= deadline:
+            break
         sys.stdout.write(f"\rLoading… {next(frames)}")
         sys.stdout.flush()
-        time.sleep(0.08)
-    # clear the spinner line
-    sys.stdout.write("\r" + " " * 30 + "\r")
-    sys.stdout.flush()
+        drew = True
+    if drew:
+        # clear the spinner line
+        sys.stdout.write("\r" + " " * 30 + "\r")
+        sys.stdout.flush()
+
+
+def flush_python(pending: List[str], frags: list) -> None:
+    """
+    Highlight buffered python-block text in one Pygments pass.
+
+    Segments arrive at arbitrary token boundaries; tokenizing each one
+    separately burns CPU and mis-colors identifiers split across chunks, so we
+    buffer until a newline (or the end of the block) and highlight once.
+    """
+    if pending:
+        frags.extend(render_python("".join(pending)))
+        pending.clear()
+
+
+def pump_body(resp: requests.Response, q: queue.Queue) -> None:
+    """
+    Producer half of the stream pipeline: read raw body blocks onto a bounded
+    queue. Errors are forwarded so the consumer re-raises them in place.
+
+    Reads resp.raw directly with decode_content off — SSE is never
+    content-encoded here, so this skips urllib3's decode/copy layer and does
+    one memcpy per block straight off the socket.
+    """
+    raw = resp.raw
+    raw.decode_content = False
+    try:
+        while chunk := raw.read(8192):
+            q.put(chunk)
+    except Exception as e:  # noqa: BLE001 - handed to the consumer
+        q.put(e)
+    q.put(None)
+
+
+def iter_sse_lines(resp: requests.Response) -> Iterator[bytes]:
+    """
+    Yield raw SSE lines from a streaming response.
+
+    A producer thread recv()s into a bounded queue (socket reads release the
+    GIL) while this generator splits lines in bulk and the caller parses and
+    renders — network and parse/display overlap instead of running serially.
+    """
+    q: queue.Queue = queue.Queue(maxsize=64)
+    threading.Thread(target=pump_body, args=(resp, q), daemon=True).start()
+    buf = bytearray()
+    drained = False
+    try:
+        while (chunk := q.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            buf += chunk
+            while (nl := buf.find(b"\n")) != -1:
+                yield bytes(buf[:nl]).rstrip(b"\r")
+                del buf[: nl + 1]
+        drained = True
+        if buf:
+            yield bytes(buf)
+    finally:
+        # The caller usually stops at [DONE] with the connection still open;
+        # close it so the pump's raw.read terminates, and keep consuming until
+        # its sentinel so a put() blocked on the full queue can finish.
+        resp.close()
+        if not drained:
+            while q.get() is not None:
+                pass
 
 
 def show_help() -> None:
@@ -91,21 +271,47 @@ def show_help() -> None:
     )
 
 
+# Slash-command handlers: each takes (cmd, hist) and returns False when the
+# program should terminate.
+def _slash_exit(cmd: str, hist: ChatHist) -> bool:
+    return False
+
+
+def _slash_clear(cmd: str, hist: ChatHist) -> bool:
+    hist.clear()
+    # clear the terminal screen with one ANSI write; no need to fork a shell
+    # just to run clear(1) (Windows consoles without VT support still shell out)
+    if os.name == "posix":
+        sys.stdout.write("\x1b[H\x1b[2J")
+        sys.stdout.flush()
+    else:
+        os.system("cls")
+    display("Context cleared.\n")
+    return True
+
+
+def _slash_help(cmd: str, hist: ChatHist) -> bool:
+    show_help()
+    return True
+
+
+def _slash_unknown(cmd: str, hist: ChatHist) -> bool:
+    display(f"Unknown command: {cmd}\n")
+    return True
+
+
+_SLASH_TABLE = {
+    "exit": _slash_exit,
+    "quit": _slash_exit,
+    "clear": _slash_clear,
+    "help": _slash_help,
+}
+
+
 def handle_slash(cmd: str, hist: ChatHist) -> bool:
     """Return False if the command should terminate the program."""
     name = cmd[1:].strip().lower()
-    if name in ("exit", "quit"):
-        return False
-    if name == "clear":
-        hist.clear()
-        # clear the terminal screen
-        os.system("clear" if os.name == "posix" else "cls")
-        display("Context cleared.\n")
-    elif name == "help":
-        show_help()
-    else:
-        display(f"Unknown command: {cmd}\n")
-    return True
+    return _SLASH_TABLE.get(name, _slash_unknown)(cmd, hist)
 
 
 class TagStreamer:
@@ -118,66 +324,90 @@ class TagStreamer:
         • None     – tag lines themselves, or normal reasoning text
     """
 
-    _TAG_RX = re.compile(r"<(/?)(python|output)>", re.IGNORECASE)
     _VALID = {"python", "output"}
 
     def __init__(self):
-        self._buf: str = ""
+        # Grow-only buffer plus a read cursor: appending and advancing are both
+        # amortized O(1), instead of re-slicing the whole buffer per match.
+        self._buf = bytearray()
+        self._pos: int = 0
         self.active: str | None = None
 
     def feed(self, chunk: str) -> list[tuple[str, str | None]]:
-        self._buf += chunk
+        self._buf += chunk.encode()
         out: list[tuple[str, str | None]] = []
 
         # 1) pull out all *complete* tags first
-        while True:
-            m = self._TAG_RX.search(self._buf)
-            if not m:
-                break
+        while m := _TAG_RX.search(self._buf, self._pos):
             start, end = m.span()
 
             # emit text before the tag under current style
-            if start:
-                out.append((self._buf[:start], self.active))
+            if start > self._pos:
+                out.append((self._buf[self._pos : start].decode(), self.active))
 
             # emit the tag itself as neutral (None)
-            tag_txt = self._buf[start:end]
-            out.append((tag_txt, None))
+            out.append((self._buf[start:end].decode(), None))
 
             # update active block
             closing, name = m.groups()
-            name = name.lower()
+            name = name.decode().lower()
             if name in self._VALID:
                 self.active = None if closing else name
 
-            self._buf = self._buf[end:]
+            self._pos = end
 
         # 2) flush any trailing text that we *know* isn't the start of a real tag
-        if self._buf:
-            idx = self._buf.find("<")
+        if self._pos < len(self._buf):
+            idx = self._buf.find(b"<", self._pos)
             if idx >= 0:
                 # if next char after '<' can't start a tag, dump everything
-                if idx + 1 >= len(self._buf) or not re.match(
-                    r"[\/A-Za-z]", self._buf[idx + 1]
+                if (
+                    idx + 1 >= len(self._buf)
+                    or self._buf[idx + 1] not in _TAG_START_CHARS
                 ):
-                    out.append((self._buf, self.active))
-                    self._buf = ""
+                    out.append((self._buf[self._pos :].decode(), self.active))
+                    self._pos = len(self._buf)
                 else:
                     # possible real tag: emit text up to that '<', keep the rest buffered
-                    safe = self._buf[:idx]
-                    if safe:
-                        out.append((safe, self.active))
-                    self._buf = self._buf[idx:]
+                    if idx > self._pos:
+                        out.append((self._buf[self._pos : idx].decode(), self.active))
+                    self._pos = idx
             else:
                 # no '<' at all → safe to flush all
-                out.append((self._buf, self.active))
-                self._buf = ""
+                out.append((self._buf[self._pos :].decode(), self.active))
+                self._pos = len(self._buf)
+
+        # drop consumed bytes once in a while so the buffer stays small
+        if self._pos > _COMPACT_AT:
+            del self._buf[: self._pos]
+            self._pos = 0
 
         return out
 
 
+class PassthroughStreamer:
+    """Zero-work stand-in for TagStreamer when tag styling is disabled."""
+
+    active: str | None = None
+
+    def feed(self, chunk: str) -> list[tuple[str, str | None]]:
+        return [(chunk, None)]
+
+
 # ─────────────────────────── main loop ─────────────────────────── #
 def main() -> None:
+    global _PIPE_OUT
+    if not _IS_TTY:
+        # Piped output (tee, less, log files) doesn't need per-delta flushing;
+        # wrap the real stdout with a big block buffer so display() writes
+        # coalesce until the per-turn flush.
+        _PIPE_OUT = io.TextIOWrapper(
+            sys.stdout.buffer,
+            encoding=sys.stdout.encoding,
+            line_buffering=False,
+            write_through=False,
+        )
+
     display(
         FormattedText([("class:prompt", "ToolSeek CLI"), ("", "  (/help for help)\n")])
     )
@@ -232,75 +462,89 @@ def main() -> None:
                 hist.append({"role": "user", "content": user_msg})
                 payload = {"messages": hist, "stream": True}
 
-                spin_evt = threading.Event()
-                spin_thread = threading.Thread(
-                    target=spinner, args=(spin_evt,), daemon=True
-                )
-                spin_thread.start()
-
                 try:
-                    resp = requests.post(API_URL, json=payload, stream=True, timeout=60)
+                    resp = SESSION.post(API_URL, json=payload, stream=True, timeout=60)
                     resp.raise_for_status()
                 except Exception as e:
-                    spin_evt.set()
-                    spin_thread.join()
                     display(f"\nRequest error: {e}\n")
                     continue
 
-                assistant_accum = ""
+                if _IS_TTY:
+                    # the spinner is pure decoration; don't animate into a pipe
+                    spin_until_readable(resp)
+
+                accum: List[str] = []
                 reasoning_done = False
                 started = False
-                tagger = TagStreamer()
+                tagger = TagStreamer() if _ENABLE_TAGS else PassthroughStreamer()
+                py_pending: List[str] = []
 
-                for line in resp.iter_lines():
-                    if not line:
-                        continue
-                    if isinstance(line, bytes):
-                        line = line.decode()
-                    if not line.startswith("data: "):
+                for line in iter_sse_lines(resp):
+                    # stay in bytes: no point utf-8-decoding heartbeat
+                    # comments, blank lines, or the [DONE] sentinel
+                    if not line or not line.startswith(b"data: "):
                         continue
                     data = line[6:]
-                    if data.strip() == "[DONE]":
+                    if data.strip() == b"[DONE]":
                         break
                     try:
-                        chunk = json.loads(data)
-                    except json.JSONDecodeError:
+                        chunk = _loads(data)
+                    except ValueError:
                         continue
 
                     if not started:
-                        spin_evt.set()
-                        spin_thread.join()
                         display(FormattedText([("class:prompt", "AI"), ("", ": ")]))
                         started = True
 
-                    delta = chunk.get("choices", [{}])[0].get("delta", {})
-                    reasoning = delta.get("reasoning_content")
-                    content = delta.get("content")
+                    choices = chunk.get("choices")
+                    delta = choices[0].get("delta") if choices else None
+                    if not delta:
+                        continue
+                    delta_get = delta.get
+                    reasoning = delta_get("reasoning_content")
+                    content = delta_get("content")
 
                     if reasoning:
+                        # collect all fragments for this delta and write them in
+                        # one go — one tty write per SSE chunk, not per segment
+                        frags: list[tuple[str, str]] = []
                         for seg, kind in tagger.feed(reasoning):
                             if kind == "python":
-                                display(ANSI(highlight(seg, _PY_LEXER, _FMT)))
+                                py_pending.append(seg)
+                                if "\n" in seg:
+                                    flush_python(py_pending, frags)
                             else:
-                                style = "output" if kind == "output" else "reason"
-                                display(FormattedText([(f"class:{style}", seg)]))
-                        assistant_accum += reasoning
+                                flush_python(py_pending, frags)
+                                frags.append((_CLS[kind], seg))
+                        if frags:
+                            display(FormattedText(frags))
+                        accum.append(reasoning)
 
                     if content:
                         if not reasoning_done:
                             reasoning_done = True
                             display(FormattedText([("class:reason", "\n")]))
-                        for seg, kind in tagger.feed(content):
-                            display(FormattedText([(f"class:output", seg)]))
-                        assistant_accum += content
-
-                display("\n")
-                hist.append({"role": "assistant", "content": assistant_accum})
+                        frags = [
+                            ("class:output", seg) for seg, _ in tagger.feed(content)
+                        ]
+                        if frags:
+                            display(FormattedText(frags))
+                        accum.append(content)
+
+                if py_pending:
+                    # stream ended inside a <python> block; render what we have
+                    frags = []
+                    flush_python(py_pending, frags)
+                    display(FormattedText(frags))
+
+                # explicit flush: one per turn instead of one per streamed delta
+                display("\n", flush=True)
+                hist.append({"role": "assistant", "content": "".join(accum)})
 
     except KeyboardInterrupt:
         pass
     finally:
-        display("\nBye!\n")
+        display("\nBye!\n", flush=True)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,17 @@
+import asyncio
+import concurrent.futures
 import os
-import json
 import re
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+import httpx
 from openai import AsyncOpenAI
+import orjson
+import functools
 import io
 import traceback
-from contextlib import redirect_stdout
 
 load_dotenv()
 
@@ -17,7 +20,20 @@ DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 if not DEEPSEEK_API_KEY:
     raise RuntimeError("DEEPSEEK_API_KEY must be set in environment")
 
-openai = AsyncOpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com/beta")
+# One shared HTTP/2 transport for all upstream calls: concurrent streams
+# multiplex over a kept-alive connection instead of paying TCP+TLS setup per
+# request, and the pool is sized for real concurrency rather than SDK defaults.
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=256, max_connections=256),
+    timeout=httpx.Timeout(None, connect=5.0),
+)
+
+openai = AsyncOpenAI(
+    api_key=DEEPSEEK_API_KEY,
+    base_url="https://api.deepseek.com/beta",
+    http_client=http_client,
+)
 
 app = FastAPI(title="DeepSeek LLM Proxy", version="0.1.0")
 
@@ -30,51 +46,136 @@ app.add_middleware(
 )
 
 
-def run_python(src: str, env: dict[str, object]) -> str:
-    buf = io.StringIO()
-    try:
-        with redirect_stdout(buf):
-            # Try eval first so `print(<expr>)` isn't required
-            try:
-                result = eval(src, env)
-                if result is not None:
-                    print(repr(result))
-            except SyntaxError:
-                exec(src, env)
-    except Exception:
-        traceback.print_exc(file=buf)
-    return buf.getvalue().rstrip() or "(no output)"
+# SSE wire framing, pre-encoded: yielding bytes from the generator lets
+# StreamingResponse skip its per-chunk str -> utf-8 encode.
+SSE_DATA = b"data: "
+SSE_SEP = b"\n\n"
+SSE_DONE = b"data: [DONE]\n\n"
 
 
-@app.post("/v1/chat/completions")
-async def chat_completions(request: Request):
-    """
-    OpenAI-compatible Chat Completions endpoint that forwards requests to DeepSeek.
-    Supports both streaming and non-streaming.
-    """
-    try:
-        body = await request.json()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail="Invalid JSON") from e
+def sse(obj: object) -> bytes:
+    """Frame one object as a Server-Sent Event, fully in bytes."""
+    return SSE_DATA + orjson.dumps(obj) + SSE_SEP
 
-    # Validate and inject special system message
-    messages = body.get("messages")
-    if not isinstance(messages, list):
-        raise HTTPException(status_code=400, detail="`messages` field must be a list")
-    for m in messages:
-        if m.get("role") == "system":
-            raise HTTPException(
-                status_code=400, detail="system messages are currently not supported"
-            )
 
-    if not body.get("stream", False):
-        raise HTTPException(
-            status_code=400, detail="only streaming is currently supported"
-        )
+# The shape of a reasoning-content delta frame never varies, so pre-build
+# everything around the one variable string; each frame is then a single
+# C-level string escape plus a bytes concat instead of a nested dict walk.
+REASONING_PRE = SSE_DATA + b'{"choices":[{"delta":{"reasoning_content":'
+REASONING_POST = b',"content":""}}]}' + SSE_SEP
 
-    user_message = {
-        "role": "user",
-        "content": f"""
+
+def reasoning_sse(text: str) -> bytes:
+    """Frame one reasoning-content delta from the fixed template."""
+    return REASONING_PRE + orjson.dumps(text) + REASONING_POST
+
+
+# The synthetic frame that opens each tool-loop restart never varies, so it's
+# serialized exactly once at import.
+OPEN_PY_FRAME = reasoning_sse("<python>\n")
+
+
+async def iter_sse_payloads(upstream):
+    """
+    Yield the payload bytes of each "data:" line in an upstream SSE stream.
+
+    Splitting the raw byte stream ourselves (same bytearray scheme as the CLI)
+    keeps the payload as the exact bytes the upstream sent, so frames that
+    only need forwarding never round-trip through str or a JSON re-encode.
+    """
+    pending = bytearray()
+    async for raw in upstream.iter_bytes():
+        pending += raw
+        while (nl := pending.find(b"\n")) != -1:
+            line = pending[:nl]
+            del pending[: nl + 1]
+            if line[-1:] == b"\r":
+                del line[-1:]
+            if line.startswith(SSE_DATA):
+                yield bytes(line[len(SSE_DATA) :])
+
+
+async def coalesce(stream, max_wait: float = 0.016, max_bytes: int = 4096):
+    """
+    Batch adjacent SSE frames into one ASGI send.
+
+    Token deltas are often 1-3 characters, and every frame pays ASGI send
+    overhead, HTTP chunk framing, and a TCP write. Collect complete frames for
+    up to max_wait seconds (below perceptual threshold) or max_bytes and emit
+    them joined — each event keeps its own data:/blank-line framing, so
+    clients still see token-by-token progress.
+    """
+    # Bounded so the pump stalls when the ASGI send does: an unbounded queue
+    # would decouple production from the client entirely and buffer without
+    # limit when the peer stops reading.
+    q: asyncio.Queue = asyncio.Queue(maxsize=64)
+
+    async def pump():
+        try:
+            async for frame in stream:
+                await q.put(frame)
+        except Exception as e:  # noqa: BLE001 - re-raised by the consumer
+            await q.put(e)
+        await q.put(None)
+
+    task = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    try:
+        done = False
+        while not done:
+            frame = await q.get()
+            if frame is None:
+                break
+            if isinstance(frame, Exception):
+                raise frame
+            batch = [frame]
+            size = len(frame)
+            deadline = loop.time() + max_wait
+            while size < max_bytes:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = await asyncio.wait_for(q.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if nxt is None:
+                    done = True
+                    break
+                if isinstance(nxt, Exception):
+                    yield b"".join(batch)
+                    raise nxt
+                batch.append(nxt)
+                size += len(nxt)
+            yield b"".join(batch) if len(batch) > 1 else batch[0]
+    finally:
+        task.cancel()
+
+
+# The stream buffer is kept as bytes end-to-end (appends into a bytearray are
+# amortized O(1), unlike str +=), so the tag sentinels are bytes too.
+PY_CLOSE = b"</python>"
+THINK_CLOSE = b"</think>"
+
+# Complete tool-call block; compiled once instead of per-delta regex work.
+# The non-greedy .*? can backtrack on pathological buffers under re's NFA,
+# so prefer google-re2's linear-time engine when it's installed.
+try:
+    import re2 as _re2
+
+    PY_RE = _re2.compile(rb"<python>(.*?)</python>", _re2.DOTALL)
+except ImportError:
+    PY_RE = re.compile(rb"<python>(.*?)</python>", re.DOTALL)
+
+# Prefixes of "</think", longest first so the cut point found is exact;
+# endswith on the whole tuple runs in one C call per token.
+THINK_PARTIALS = tuple(b"</think"[:i] for i in range(len(b"</think"), 0, -1))
+
+
+# Wrapper injected around the final user message. Built (and stripped) once at
+# import; per request it's filled with a single %s substitution instead of
+# re-assembling the whole literal in the handler.
+WRAP_TEMPLATE = """
 This is a system message, not written by the user.
 You have a special Python tool which lets you run Python code by outputting <python> tags inside your think section.
 The code will be extracted and executed, and you will see the output immediately.
@@ -88,11 +189,14 @@ The system can only execute code BEFORE you complete the thinking section -- thi
 
 Here is the user query, which you should solve using code execution:
 
-{messages[-1]["content"]}
-        """.strip(),
-    }
+%s
+""".strip()
+
 
-    prefix = """
+# Seed assistant prefix for the tool loop, encoded once at import. Each
+# request copies it into a bytearray so appending streamed deltas is an
+# amortized O(1) extend instead of re-copying an ever-growing str.
+PREFIX_BYTES = """
 <think>
 Okay, so apparently I can use Python inside this section. Let me try it:
 
@@ -119,7 +223,116 @@ Perfect. It works, and I can reference earlier variables and functions. That is
 
 Okay, let's start working on the user's query with this. Let me write a first attempt in <python> tags, then I'll see the results and iterate.
 
-<python>\n""".lstrip()
+<python>\n""".lstrip().encode()
+
+
+# Model-authored code is executed on worker threads so a blocking snippet
+# (time.sleep, network calls, heavy imports) can't stall every other SSE
+# stream running on the event loop.
+PY_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+
+class TruncatingBuffer(io.TextIOBase):
+    """
+    Write sink with a hard size cap.
+
+    Model code can print without bound, and an unbounded StringIO would grow
+    until the worker OOMs. Past the cap, writes are dropped and the captured
+    output gains a trailing truncation marker.
+    """
+
+    def __init__(self, limit: int = 64_000):
+        self._parts: list[str] = []
+        self._size = 0
+        self._limit = limit
+        self.truncated = False
+
+    def write(self, s: str) -> int:
+        if not self.truncated:
+            room = self._limit - self._size
+            if len(s) > room:
+                self._parts.append(s[:room])
+                self._size = self._limit
+                self.truncated = True
+            else:
+                self._parts.append(s)
+                self._size += len(s)
+        return len(s)
+
+    def getvalue(self) -> str:
+        out = "".join(self._parts)
+        if self.truncated:
+            out += "\n... (output truncated)"
+        return out
+
+
+# Full tracebacks of failed tool code are mostly our own frames, which waste
+# model context (and leak server paths); opt back in when debugging.
+_DEBUG_TRACEBACKS = bool(os.getenv("TOOLSEEK_DEBUG"))
+
+
+def run_python(src: str, env: dict[str, object]) -> str:
+    buf = TruncatingBuffer()
+    # Capture output by handing the tool code a print bound to this call's
+    # buffer rather than redirecting sys.stdout: the redirect swaps the
+    # process-global stream, so on the worker pool it would capture prints
+    # from concurrent requests (and the event loop) into the wrong output.
+    env["print"] = functools.partial(print, file=buf)
+    try:
+        # Try eval first so `print(<expr>)` isn't required
+        try:
+            result = eval(src, env)
+            if result is not None:
+                print(repr(result), file=buf)
+        except SyntaxError:
+            exec(src, env)
+    except Exception as e:
+        if _DEBUG_TRACEBACKS:
+            traceback.print_exc(file=buf)
+        else:
+            buf.write("".join(traceback.format_exception_only(type(e), e)))
+    return buf.getvalue().rstrip() or "(no output)"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """
+    OpenAI-compatible Chat Completions endpoint that forwards requests to DeepSeek.
+    Supports both streaming and non-streaming.
+    """
+    try:
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail="Invalid JSON") from e
+
+    # Validate and inject special system message; one pass over the messages
+    # with direct key access, which also pulls out the final user content
+    messages = body.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise HTTPException(
+            status_code=400, detail="`messages` field must be a non-empty list"
+        )
+    try:
+        has_system = any(m["role"] == "system" for m in messages)
+        last_content = messages[-1]["content"]
+    except (KeyError, TypeError) as e:
+        raise HTTPException(
+            status_code=400, detail="each message must have `role` and `content`"
+        ) from e
+    if has_system:
+        raise HTTPException(
+            status_code=400, detail="system messages are currently not supported"
+        )
+
+    if not body.get("stream", False):
+        raise HTTPException(
+            status_code=400, detail="only streaming is currently supported"
+        )
+
+    user_message = {
+        "role": "user",
+        "content": WRAP_TEMPLATE % (last_content,),
+    }
 
     # Forward parameters directly
     params = body.copy()
@@ -127,165 +340,189 @@ Okay, let's start working on the user's query with this. Let me write a first at
     params["stream"] = True
 
     py_env: dict[str, object] = {}
-    is_thinking = True
-    needs_restart = False
-    start_with_code = True
+
+    # The static head of the injected conversation never changes across tool
+    # iterations; only the assistant prefix dict is rebuilt per restart.
+    static_messages = messages[:-1] + [user_message]
 
     async def event_stream():
-        nonlocal is_thinking
-        nonlocal needs_restart
-        nonlocal prefix
-        nonlocal start_with_code
+        # Loop state lives as generator locals rather than closed-over cells:
+        # these are touched on every streamed token, and LOAD_FAST is cheaper
+        # than the LOAD_DEREF a nonlocal binding would cost per access.
+        prefix = bytearray(PREFIX_BYTES)
+        is_thinking = True
+        needs_restart = False
+        start_with_code = True
 
         # Tool loop - we will re-run each time the model produces a tool call.
         # We run the code, update the prefix with the output, then restart with the new prefix.
         while True:
-            buffer = ""
-            already_sent = ""
-            maybe_send = ""
-            injected_messages = messages[:-1] + [
-                user_message,
+            buffer = bytearray()
+            # Everything before this offset has already been sent to the
+            # client; an int cursor replaces the old already-sent string and
+            # its per-token prefix comparisons.
+            sent_upto = 0
+            # Bytes before this offset have already been scanned for </think>
+            think_scan_from = 0
+            params["messages"] = static_messages + [
                 {
                     "role": "assistant",
                     "prefix": True,
-                    "content": prefix,
-                },
+                    "content": prefix.decode(),
+                }
             ]
-            params["messages"] = injected_messages
 
             print(f"Making request with params: {params}")
             try:
-                async for chunk in await openai.chat.completions.create(**params):
-                    if start_with_code:
-                        buffer = "<python>\n"
-                        already_sent = "<python>\n"
-                        start_with_code = False
-                        yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': '<python>\n', 'content': ''}}]})}\n\n"
-                    data = chunk.to_dict()
-                    print(f"Received chunk: {data}")
-
-                    # No longer in CoT -> nothing to do, just forward the data
-                    if not is_thinking:
-                        yield f"data: {json.dumps(data)}\n\n"
-                        continue
-
-                    # Update buffer with new content
-                    choices = data.get("choices")
-                    if choices:
-                        delta = choices[0].get("delta", {})
-
-                        if text := delta.get("content"):
-                            buffer += text
-
-                            # Emit the delta to the client, up to and including any </python> tags
-                            # Process the buffer to handle Python code blocks
-                            if "</python>" in buffer:
-                                # Only yield up to the </python> tag, the rest will be processed
-                                parts = buffer.split("</python>", 1)
-                                text_to_yield = parts[0] + "</python>"
-                                # Only send what hasn't been sent yet
-                                if text_to_yield.startswith(already_sent):
-                                    new_content = text_to_yield[len(already_sent) :]
-                                    if new_content:
-                                        yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': new_content, 'content': ''}}]})}\n\n"
-                                        already_sent += new_content
+                # Stream the raw upstream SSE bytes: parsing each frame once
+                # with orjson skips the SDK's per-chunk pydantic validation
+                # and to_dict() walk, which existed only to be re-serialized.
+                async with openai.chat.completions.with_streaming_response.create(
+                    **params
+                ) as upstream:
+                    async for payload in iter_sse_payloads(upstream):
+                        if payload.strip() == b"[DONE]":
+                            break
+                        if start_with_code:
+                            buffer += b"<python>\n"
+                            sent_upto = len(buffer)
+                            start_with_code = False
+                            yield OPEN_PY_FRAME
+
+                        # No longer in CoT -> forward the upstream frame bytes
+                        # untouched, without even parsing them
+                        if not is_thinking:
+                            yield SSE_DATA + payload + SSE_SEP
+                            continue
+                        data = orjson.loads(payload)
+
+                        # Update buffer with new content
+                        choices = data.get("choices")
+                        if choices:
+                            delta = choices[0].get("delta", {})
+
+                            if text := delta.get("content"):
+                                prev_len = len(buffer)
+                                buffer += text.encode()
+
+                                # Emit the delta to the client, up to and including any </python> tags
+                                # Process the buffer to handle Python code blocks.
+                                # Only bytes not yet examined (plus a tag-sized
+                                # overlap) can contain a newly completed tag, so
+                                # each sentinel gets one bounded scan per delta.
+                                close_idx = buffer.find(
+                                    PY_CLOSE, max(0, prev_len - len(PY_CLOSE) + 1)
+                                )
+                                think_idx = buffer.find(THINK_CLOSE, think_scan_from)
+                                think_scan_from = max(
+                                    think_scan_from, len(buffer) - len(THINK_CLOSE) + 1
+                                )
+                                if close_idx != -1:
+                                    # Only yield up to the </python> tag, the rest will be processed
+                                    cut = close_idx + len(PY_CLOSE)
+                                    if cut > sent_upto:
+                                        new_content = buffer[sent_upto:cut]
+                                        yield reasoning_sse(new_content.decode())
+                                        sent_upto = cut
+                                        prefix += new_content
+                                elif buffer.endswith(THINK_PARTIALS):
+                                    # If buffer ends with a partial "</think" tag, we don't want to send any of those tokens, only tokens prior to that
+                                    # Find the position where the partial closing tag starts
+                                    hit = next(
+                                        s for s in THINK_PARTIALS if buffer.endswith(s)
+                                    )
+                                    # Yield everything up to the start of the partial
+                                    # tag; the held-back bytes stay unsent until a
+                                    # later delta resolves the tag
+                                    cut = len(buffer) - len(hit)
+                                    if cut > sent_upto:
+                                        new_content = buffer[sent_upto:cut]
+                                        yield reasoning_sse(new_content.decode())
+                                        sent_upto = cut
+                                        prefix += new_content
+                                    continue
+                                elif think_idx != -1:
+                                    # Only yield up to the </think> tag
+                                    cut = think_idx
+                                    if cut > sent_upto:
+                                        new_content = buffer[sent_upto:cut]
+                                        yield reasoning_sse(new_content.decode())
+                                        sent_upto = cut
                                         prefix += new_content
-                            elif any(
-                                buffer.endswith("</think"[:i])
-                                for i in range(1, len("</think") + 1)
-                            ):
-                                # If buffer ends with a partial "</think" tag, we don't want to send any of those tokens, only tokens prior to that
-                                # Find the position where the partial closing tag starts
-                                for i in range(len("</think"), 0, -1):
-                                    if buffer.endswith("</think"[:i]):
-                                        # Yield everything up to the start of the partial tag
-                                        text_to_yield = buffer[:-i]
-                                        # Only send what hasn't been sent yet
-                                        if text_to_yield.startswith(already_sent):
-                                            new_content = text_to_yield[
-                                                len(already_sent) :
-                                            ]
-                                            if new_content:
-                                                yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': new_content, 'content': ''}}]})}\n\n"
-                                                already_sent += new_content
-                                                prefix += new_content
-                                        # Queue the partial closing tag in maybe_send
-                                        maybe_send = buffer[-i:]
-                                        break
-                                continue
-                            elif "</think>" in buffer:
-                                # Only yield up to the </think> tag
-                                parts = buffer.split("</think>", 1)
-                                text_to_yield = parts[0]
-                                # Only send what hasn't been sent yet
-                                if text_to_yield.startswith(already_sent):
-                                    new_content = text_to_yield[len(already_sent) :]
-                                    if new_content:
-                                        yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': new_content, 'content': ''}}]})}\n\n"
-                                        already_sent += new_content
+                                    # We're done with the thinking section; the
+                                    # incremental appends above already put all
+                                    # of buffer[:cut] into the prefix, so only
+                                    # the closing tag is still missing
+                                    is_thinking = False
+                                    # For simplicity for now, we just restart the tool loop
+                                    prefix += b"</think>\n"
+                                    needs_restart = True
+                                    break
+                                else:
+                                    # Nothing to hold back: flush all unsent bytes,
+                                    # including any partial tag held from earlier
+                                    if len(buffer) > sent_upto:
+                                        new_content = buffer[sent_upto:]
+                                        yield reasoning_sse(new_content.decode())
+                                        sent_upto = len(buffer)
                                         prefix += new_content
-                                # We're done with the thinking section
-                                is_thinking = False
-                                # For simplicity for now, we just restart the tool loop
-                                prefix += text_to_yield + "</think>\n"
+                                    continue
+
+                                # Look for a complete Python code block. One scan
+                                # per completed close tag; the tool loop restarts
+                                # with a fresh buffer after every match, so no
+                                # extra scan offset is needed.
+                                m = PY_RE.search(buffer)
+                                if not m:
+                                    continue
+
+                                # Extract the content between the <python> and </python> tags
+                                code = m.group(1).decode()
+
+                                loop = asyncio.get_running_loop()
+                                output = await loop.run_in_executor(
+                                    PY_POOL, run_python, code, py_env
+                                )
+                                formatted_output = f"\n<output>\n{output}\n</output>"
+                                prefix += formatted_output.encode()
+
+                                # Yield the output to the client; no cursor update
+                                # needed since the restart resets the buffer
+                                yield reasoning_sse(formatted_output)
+
+                                # Restart with the new prefix
                                 needs_restart = True
                                 break
-                            else:
-                                if maybe_send:
-                                    yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': maybe_send, 'content': ''}}]})}\n\n"
-                                    already_sent += maybe_send
-                                    prefix += maybe_send
-                                    maybe_send = ""
-                                yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': text, 'content': ''}}]})}\n\n"
-                                already_sent += text
-                                prefix += text
-                                continue
-
-                            # Look for complete Python code block
-                            # Find the last occurrence of <python>...</python> in the buffer
-                            last_start = (
-                                buffer.rindex("<python>")
-                                if "<python>" in buffer
-                                else -1
-                            )
-                            last_end = (
-                                buffer.rindex("</python>")
-                                if "</python>" in buffer
-                                else -1
-                            )
-                            if (
-                                last_start == -1
-                                or last_end == -1
-                                or last_start > last_end
-                            ):
-                                continue
-
-                            # Extract the content between the last <python> and </python> tags
-                            code = buffer[last_start + len("<python>") : last_end]
-
-                            output = run_python(code, py_env)
-                            formatted_output = f"\n<output>\n{output}\n</output>"
-                            prefix += formatted_output
-
-                            # Yield the output to the client
-                            yield f"data: {json.dumps({'choices': [{'delta': {'reasoning_content': formatted_output, 'content': ''}}]})}\n\n"
-                            already_sent += formatted_output
-
-                            # Restart with the new prefix
-                            needs_restart = True
-                            break
 
                 if needs_restart:
                     needs_restart = False
                     continue
 
                 # signal end of stream
-                yield "data: [DONE]\n\n"
+                yield SSE_DONE
+                break
             except Exception as e:
                 # In case of error, send error message and close
                 err = {"error": {"message": str(e)}}
-                yield f"data: {json.dumps(err)}\n\n"
-                yield "data: [DONE]\n\n"
+                yield sse(err)
+                yield SSE_DONE
                 break
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    return StreamingResponse(
+        coalesce(event_stream()),
+        media_type="text/event-stream",
+        headers={
+            # keep reverse proxies from buffering or caching the stream
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # every SSE yield round-trips through the event loop, so pin uvloop rather
+    # than relying on --loop auto; `uvicorn server:app` picks it up too since
+    # it's in requirements.txt
+    uvicorn.run(app, host="127.0.0.1", port=8000, loop="uvloop")